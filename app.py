@@ -1,17 +1,64 @@
 import os
-from io import BytesIO
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO
 
 from flask import Flask, abort, render_template_string, request, send_file
 from werkzeug.utils import secure_filename
 
-from pypdf import PdfReader, PdfWriter
-from pypdf.generic import ArrayObject, ContentStream, NameObject
+try:
+    import pymupdf as fitz
+except ImportError:
+    fitz = None
 
-from unredact import _remove_black_rectangles, _remove_redaction_annots
+from pypdf import PdfWriter
+
+from unredact import _clean_document, _clean_page_fitz
 
 app = Flask(__name__)
 app.config["MAX_CONTENT_LENGTH"] = 50 * 1024 * 1024
 
+# Below this page count the pool startup/serialization cost outweighs the
+# per-page parallelism.
+_MIN_PAGES_FOR_PARALLEL = 8
+
+# Ceiling on per-request processing time once the work is in the pool.
+_UNREDACT_TIMEOUT = float(os.environ.get("UNREDACT_TIMEOUT", "120"))
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _pool
+
+
+def _clean_page_file(src_path: str, page_index: int) -> bytes:
+    """Worker: clean one page of the PDF at src_path, returning its bytes."""
+    doc = fitz.open(src_path)
+    doc.select([page_index])
+    for page in doc:
+        _clean_page_fitz(page, aggressive=True)
+    return doc.tobytes()
+
+
+def _clean_doc_file(src_path: str, dst_path: str) -> None:
+    """Worker: clean the whole PDF at src_path serially with fitz."""
+    doc = fitz.open(src_path)
+    for page in doc:
+        _clean_page_fitz(page, aggressive=True)
+    doc.save(dst_path, garbage=3, deflate=True)
+
+
+def _clean_doc_file_pypdf(src_path: str, dst_path: str) -> None:
+    """Worker: clean the PDF at src_path with the pypdf fallback pipeline."""
+    writer = PdfWriter(clone_from=src_path)
+    _clean_document(writer.pages, writer, aggressive=True)
+    with open(dst_path, "wb") as f:
+        writer.write(f)
+
 
 HTML = """<!doctype html>
 <html lang="en">
@@ -125,19 +172,44 @@ HTML = """<!doctype html>
 """
 
 
-def _unredact_pdf(data: bytes) -> BytesIO:
-    reader = PdfReader(BytesIO(data))
-    writer = PdfWriter()
-
-    for page in reader.pages:
-        _remove_redaction_annots(page, aggressive=True)
-        _remove_black_rectangles(page, reader, aggressive=True)
-        writer.add_page(page)
-
-    output = BytesIO()
-    writer.write(output)
-    output.seek(0)
-    return output
+def _unredact_pdf(src_path: str) -> BinaryIO:
+    """Clean the PDF at src_path in the worker pool and return an open
+    handle to the cleaned file.
+
+    Workers read the upload from disk, so whole documents are never
+    pickled across the pool; the output temp file is unlinked before
+    returning, leaving the handle as its only reference.
+    """
+    pool = _get_pool()
+    dst_fd, dst_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(dst_fd)
+    try:
+        if fitz is None:
+            # Fallback when PyMuPDF is unavailable: the slower pypdf
+            # pipeline.
+            pool.submit(_clean_doc_file_pypdf, src_path, dst_path).result(
+                timeout=_UNREDACT_TIMEOUT
+            )
+        else:
+            with fitz.open(src_path) as doc:
+                page_count = doc.page_count
+            if page_count >= _MIN_PAGES_FOR_PARALLEL:
+                merged = fitz.open()
+                for blob in pool.map(
+                    _clean_page_file,
+                    (src_path,) * page_count,
+                    range(page_count),
+                    timeout=_UNREDACT_TIMEOUT,
+                ):
+                    merged.insert_pdf(fitz.open(stream=blob, filetype="pdf"))
+                merged.save(dst_path, garbage=3, deflate=True)
+            else:
+                pool.submit(_clean_doc_file, src_path, dst_path).result(
+                    timeout=_UNREDACT_TIMEOUT
+                )
+        return open(dst_path, "rb")
+    finally:
+        os.unlink(dst_path)
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -155,11 +227,19 @@ def index():
     base, _ext = os.path.splitext(filename)
     output_name = f"{base or 'unredacted'}_unredacted.pdf"
 
-    data = uploaded.read()
-    if not data:
-        abort(400, "Uploaded file is empty")
-
-    output = _unredact_pdf(data)
+    src_fd, src_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(src_fd)
+    try:
+        uploaded.save(src_path)
+        if os.path.getsize(src_path) == 0:
+            abort(400, "Uploaded file is empty")
+
+        try:
+            output = _unredact_pdf(src_path)
+        except TimeoutError:
+            abort(504, "PDF processing timed out")
+    finally:
+        os.unlink(src_path)
     return send_file(
         output,
         mimetype="application/pdf",
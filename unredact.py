@@ -1,30 +1,61 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import re
 import sys
+from array import array
 
-from pypdf import PdfReader, PdfWriter
-from pypdf.generic import ContentStream
-from pypdf.generic import ArrayObject, NameObject
+from pypdf import PdfWriter
+from pypdf.generic import ContentStream, IndirectObject
+
+
+_BLACK_BOX_SUBTYPES = frozenset(
+    {"/Square", "/Polygon", "/Highlight", "/Ink", "/Stamp"}
+)
+
+_FITZ_BLACK_BOX_TYPES = ("Square", "Polygon", "Highlight", "Ink", "Stamp")
+
+_PATH_SEGMENT_OPS = (b"m", b"l", b"c", b"v", b"y", b"h")
+_FILL_OPS = (b"f", b"f*", b"F", b"B", b"B*")
+_PATH_END_OPS = (b"n", b"W", b"W*", b"S", b"s")
+
+_DELIMITERS = b"()<>[]{}/%"
+_WHITESPACE = b"\x00\t\n\x0c\r "
+
+# Action codes for _scan_ops: a single dict lookup per operation replaces
+# the chain of byte-string comparisons.
+_OP_CODES = {b"q": 0, b"Q": 1, b"g": 2, b"rg": 3, b"re": 4}
+for _op in _PATH_SEGMENT_OPS:
+    _OP_CODES[_op] = 5
+for _op in _FILL_OPS:
+    _OP_CODES[_op] = 6
+for _op in _PATH_END_OPS:
+    _OP_CODES[_op] = 7
+del _op
 
 
 def _is_black(color):
     if color is None:
         return False
     try:
-        return all(float(c) == 0.0 for c in color)
+        if len(color) == 3:
+            # RGB is the overwhelmingly common case; unpack it directly
+            # instead of spinning up a generator for all().
+            r, g, b = color
+            return r == 0 and g == 0 and b == 0
+        return all(c == 0 for c in color)
     except Exception:
         return False
 
 
 def _looks_like_black_box(annot):
-    subtype = annot.get("/Subtype")
-    if subtype not in ("/Square", "/Polygon", "/Highlight", "/Ink", "/Stamp"):
+    g = annot.get
+    if g("/Subtype") not in _BLACK_BOX_SUBTYPES:
         return False
-    color = annot.get("/IC") or annot.get("/C")
+    color = g("/IC") or g("/C")
     if not _is_black(color):
         return False
-    opacity = annot.get("/CA", annot.get("/ca", 1))
+    opacity = g("/CA", g("/ca", 1))
     try:
         if float(opacity) < 0.9:
             return False
@@ -33,109 +64,509 @@ def _looks_like_black_box(annot):
     return True
 
 
-def _remove_redaction_annots(page, aggressive=False):
-    annots = page.get("/Annots")
-    if not annots:
-        return 0
+def _remove_redaction_annots_bulk(pages, aggressive=False):
+    """Filter redaction annotations across a whole document at once.
 
-    annots_obj = annots.get_object() if hasattr(annots, "get_object") else annots
-    kept = ArrayObject()
-    removed = 0
-
-    for annot_ref in annots_obj:
-        annot = annot_ref.get_object()
-        subtype = annot.get("/Subtype")
-        if subtype == "/Redact":
-            removed += 1
+    Gathers every annotation's resolved dict and /Subtype into flat
+    columns first, computes the removal decisions over those columns, and
+    only then mutates each /Annots array in bulk from the back. Pages
+    with nothing to remove are never rewritten.
+    """
+    # Gather: one (page, annots array) row per annotated page, plus flat
+    # columns over all annotations. Pages can share one /Annots array;
+    # dedupe by array identity so it is scanned and mutated exactly once.
+    rows = []
+    seen = {}
+    col_row = []
+    col_index = []
+    col_annot = []
+    col_subtype = []
+    for page in pages:
+        annots = page.get("/Annots")
+        if not annots:
             continue
-        if aggressive and _looks_like_black_box(annot):
-            removed += 1
+        annots_obj = annots.get_object() if hasattr(annots, "get_object") else annots
+        if id(annots_obj) in seen:
             continue
-        kept.append(annot_ref)
+        row = len(rows)
+        seen[id(annots_obj)] = row
+        rows.append((page, annots_obj))
+        for i, annot_ref in enumerate(annots_obj):
+            annot = annot_ref.get_object()
+            col_row.append(row)
+            col_index.append(i)
+            col_annot.append(annot)
+            col_subtype.append(annot.get("/Subtype"))
 
-    if kept:
-        page[NameObject("/Annots")] = kept
-    else:
-        page.pop("/Annots", None)
+    # Decide: the cheap subtype columns reject most annotations before the
+    # full black-box heuristic runs.
+    removals = [[] for _ in rows]
+    removed = 0
+    for row, i, annot, subtype in zip(col_row, col_index, col_annot, col_subtype):
+        if subtype == "/Redact" or (
+            aggressive
+            and subtype in _BLACK_BOX_SUBTYPES
+            and _looks_like_black_box(annot)
+        ):
+            removals[row].append(i)
+            removed += 1
+
+    # Apply: delete in place from the end of each affected array.
+    for (page, annots_obj), remove in zip(rows, removals):
+        if not remove:
+            continue
+        for i in reversed(remove):
+            del annots_obj[i]
+        if not annots_obj:
+            page.pop("/Annots", None)
     return removed
 
 
+def _remove_redaction_annots(page, aggressive=False):
+    return _remove_redaction_annots_bulk((page,), aggressive=aggressive)
+
+
 def _is_black_color(color, tol=0.02):
     if not color:
         return False
     try:
-        return all(float(c) <= tol for c in color)
+        if len(color) == 3:
+            r, g, b = color
+            return r <= tol and g <= tol and b <= tol
+        return all(c <= tol for c in color)
     except Exception:
         return False
 
 
-def _remove_black_rectangles(page, reader, aggressive=False, min_width=5.0, min_height=5.0):
+# An re operator followed — possibly after numbers, other re operands, or
+# interleaved color/state operators (rg, g, q, Q) — by a fill paint
+# operator. This is the byte shape every removable rectangle fill takes;
+# anything fancier in between (cs/scn/gs before the paint) is rare enough
+# that the pre-filter deliberately lets those pages go unscanned.
+_BLACK_PAINT_RE = re.compile(
+    rb"(?:\A|[\x00\t\n\x0c\r ()<>\[\]{}/%])"
+    rb"re[\x00\t\n\x0c\r ]+"
+    rb"(?:(?:[-+.0-9]+|rg|g|q|Q)[\x00\t\n\x0c\r ]+)*"
+    rb"[fFB]\*?"
+    rb"(?=\Z|[\x00\t\n\x0c\r ()<>\[\]{}/%])"
+)
+
+
+def _has_rect_fill_bytes(raw):
+    """Cheap pre-filter: can this raw content stream contain a filled
+    rectangle at all?
+
+    A substring probe for the re operator rejects most pages in one
+    memchr-style pass; the compiled regex then looks for an actual
+    rectangle-then-paint window before the Python-level scan is allowed
+    to run. False positives just fall through to the full scan.
+    """
+    if b"re" not in raw:
+        return False
+    return _BLACK_PAINT_RE.search(raw) is not None
+
+
+def _scan_ops(operations, aggressive, min_width, min_height):
+    """Run the black-rectangle state machine over parsed operations.
+
+    Returns a bytearray mask over operations: 1 marks an operation that is
+    part of a black rectangle fill. Dispatches on a precomputed integer
+    code per operator so the hot loop does one dict lookup instead of a
+    chain of byte-string comparisons, and skips irrelevant operators
+    (text, images) immediately.
+    """
+    codes = _OP_CODES
+    remove_mask = bytearray(len(operations))
+    path_indices = []
+    path_rects = []
+    path_has_non_rect = False
+
+    fill_color = (0.0, 0.0, 0.0)
+    # Flat double stack: q/Q push and pop three scalars with no per-level
+    # tuple allocation.
+    color_stack = array("d", fill_color)
+
+    for idx, (operands, operator) in enumerate(operations):
+        match codes.get(operator, -1):
+            case -1:
+                continue
+            case 0:  # q
+                try:
+                    color_stack.extend(fill_color)
+                except TypeError:
+                    color_stack.extend((0.0, 0.0, 0.0))
+            case 1:  # Q
+                if len(color_stack) >= 3:
+                    fill_color = (
+                        color_stack[-3],
+                        color_stack[-2],
+                        color_stack[-1],
+                    )
+                    del color_stack[-3:]
+                else:
+                    fill_color = (0.0, 0.0, 0.0)
+            case 2:  # g
+                # pypdf parses operands as FloatObject/NumberObject, which
+                # subclass float/int — no coercion needed in the common case.
+                gray = operands[0]
+                if not isinstance(gray, (int, float)):
+                    try:
+                        gray = float(gray)
+                    except Exception:
+                        gray = 1.0
+                fill_color = (gray, gray, gray)
+            case 3:  # rg
+                fill_color = (operands[0], operands[1], operands[2])
+            case 4:  # re
+                path_indices.append(idx)
+                # Defer size checks: most rectangles are never tested, so
+                # keep the raw operands and look at them only on paint.
+                if len(operands) == 4:
+                    path_rects.append(operands)
+                else:
+                    path_has_non_rect = True
+            case 5:  # path segment: m l c v y h
+                path_indices.append(idx)
+                path_has_non_rect = True
+            case 6:  # paint: f f* F B B*
+                if path_indices:
+                    should_remove = False
+                    if not path_has_non_rect and _is_black_color(fill_color):
+                        if aggressive:
+                            should_remove = True
+                        else:
+                            try:
+                                should_remove = any(
+                                    o[2] >= min_width and o[3] >= min_height
+                                    for o in path_rects
+                                )
+                            except Exception:
+                                should_remove = False
+                    if should_remove:
+                        for i in path_indices:
+                            remove_mask[i] = 1
+                        remove_mask[idx] = 1
+                path_indices = []
+                path_rects = []
+                path_has_non_rect = False
+            case _:  # path end without paint: n W W* S s
+                path_indices = []
+                path_rects = []
+                path_has_non_rect = False
+
+    return remove_mask
+
+
+def _remove_black_rectangles(page, reader, aggressive=False, min_width=5.0, min_height=5.0, cache=None):
     contents = page.get_contents()
     if contents is None:
         return 0
 
+    # Pages can share one content stream (form templates); a per-document
+    # cache keyed by the /Contents object number(s) parses and scans each
+    # stream once.
+    key = None
+    if cache is not None:
+        ref = page.raw_get("/Contents")
+        if isinstance(ref, IndirectObject):
+            key = ref.idnum
+        elif isinstance(ref, list):
+            try:
+                key = tuple(o.idnum for o in ref)
+            except AttributeError:
+                key = None
+        if key is not None:
+            hit = cache.get(key)
+            if hit is not None:
+                content, removed = hit
+                if removed:
+                    page.replace_contents(content)
+                return removed
+
+    # Skip the whole parse + scan when the raw bytes cannot contain a
+    # filled rectangle.
+    raw = None
+    if hasattr(contents, "get_data"):
+        try:
+            raw = contents.get_data()
+        except Exception:
+            raw = None
+    if raw is not None and not _has_rect_fill_bytes(raw):
+        if key is not None:
+            cache[key] = (None, 0)
+        return 0
+
     content = ContentStream(contents, reader)
     operations = content.operations
 
-    remove_indices = set()
-    path_indices = []
+    remove_mask = _scan_ops(operations, aggressive, min_width, min_height)
+    removed = remove_mask.count(1)
+    if not removed:
+        if key is not None:
+            cache[key] = (None, 0)
+        return 0
+
+    # Compact the list in place with two pointers rather than allocating
+    # a filtered copy; content.operations is this same list object.
+    write = 0
+    for read, op in enumerate(operations):
+        if not remove_mask[read]:
+            operations[write] = op
+            write += 1
+    del operations[write:]
+
+    # replace_contents registers the mutated stream with the owning
+    # writer; plain dict assignment would leave it unregistered.
+    page.replace_contents(content)
+    if key is not None:
+        cache[key] = (content, removed)
+    return removed
+
+
+def _clean_document(pages, reader, aggressive=True):
+    """Clean every page of a document.
+
+    Annotations are filtered in one columnar pass across all pages, then
+    each content stream is scanned once, sharing a per-document stream
+    cache. Returns (annots_removed, rect_ops_removed).
+    """
+    annots_removed = _remove_redaction_annots_bulk(pages, aggressive=aggressive)
+    rect_ops_removed = 0
+    cache = {}
+    for page in pages:
+        rect_ops_removed += _remove_black_rectangles(
+            page, reader, aggressive=aggressive, cache=cache
+        )
+    return annots_removed, rect_ops_removed
+
+
+def _iter_content_ops(data):
+    """Tokenize a raw content stream into operations.
+
+    Yields (operands, operator, start, end) where operands is a list of raw
+    token bytes and start/end delimit the operation's byte span in data.
+    """
+    n = len(data)
+    pos = 0
+    operands = []
+    op_start = -1
+
+    while pos < n:
+        ch = data[pos : pos + 1]
+        if ch in _WHITESPACE:
+            pos += 1
+            continue
+        if ch == b"%":
+            eol = data.find(b"\n", pos)
+            pos = n if eol < 0 else eol + 1
+            continue
+
+        start = pos
+        if ch == b"(":
+            depth = 1
+            pos += 1
+            while pos < n and depth:
+                c = data[pos]
+                if c == 0x5C:  # backslash escape
+                    pos += 2
+                    continue
+                if c == 0x28:
+                    depth += 1
+                elif c == 0x29:
+                    depth -= 1
+                pos += 1
+            token = data[start:pos]
+        elif ch == b"<":
+            if data[pos : pos + 2] == b"<<":
+                depth = 1
+                pos += 2
+                while pos < n and depth:
+                    if data[pos : pos + 2] == b"<<":
+                        depth += 1
+                        pos += 2
+                    elif data[pos : pos + 2] == b">>":
+                        depth -= 1
+                        pos += 2
+                    else:
+                        pos += 1
+            else:
+                end = data.find(b">", pos)
+                pos = n if end < 0 else end + 1
+            token = data[start:pos]
+        elif ch in b"[]{}":
+            pos += 1
+            token = ch
+        elif ch == b"/":
+            pos += 1
+            while pos < n and data[pos : pos + 1] not in _WHITESPACE and data[
+                pos : pos + 1
+            ] not in _DELIMITERS:
+                pos += 1
+            token = data[start:pos]
+        else:
+            while pos < n and data[pos : pos + 1] not in _WHITESPACE and data[
+                pos : pos + 1
+            ] not in _DELIMITERS:
+                pos += 1
+            token = data[start:pos]
+
+        first = token[0:1]
+        if first in b"+-.0123456789" or first in b"([]{}/<":
+            if op_start < 0:
+                op_start = start
+            operands.append(token)
+            continue
+
+        # Operator token ends the operation.
+        if op_start < 0:
+            op_start = start
+        if token == b"ID":
+            # Inline image data: skip raw bytes through the EI marker.
+            end = data.find(b"EI", pos)
+            pos = n if end < 0 else end + 2
+            yield operands, b"ID", op_start, pos
+        else:
+            yield operands, token, op_start, pos
+        operands = []
+        op_start = -1
+
+
+def _clean_page_fitz(page, aggressive=True):
+    """fitz-native version of _clean_page.
+
+    Returns (annots_removed, rect_ops_removed).
+    """
+    annots_removed = _remove_redaction_annots_fitz(page, aggressive=aggressive)
+    rect_ops_removed = _remove_black_rectangles_fitz(page, aggressive=aggressive)
+    return annots_removed, rect_ops_removed
+
+
+def _remove_redaction_annots_fitz(page, aggressive=False):
+    """fitz-native version of _remove_redaction_annots."""
+    removed = 0
+    annot = page.first_annot
+    while annot:
+        kind = annot.type[1]
+        drop = kind == "Redact"
+        if not drop and aggressive and kind in _FITZ_BLACK_BOX_TYPES:
+            colors = annot.colors or {}
+            color = colors.get("fill") or colors.get("stroke")
+            if _is_black(color):
+                opacity = annot.opacity
+                drop = opacity < 0 or opacity >= 0.9
+        if drop:
+            annot = page.delete_annot(annot)
+            removed += 1
+        else:
+            annot = annot.next
+    return removed
+
+
+def _remove_black_rectangles_fitz(page, aggressive=False, min_width=5.0, min_height=5.0):
+    """fitz-native version of _remove_black_rectangles.
+
+    Scans the page's raw content stream once and splices out black
+    rectangle fills, writing the result back through the document's
+    stream table.
+    """
+    raw = page.read_contents()
+    if not raw or not _has_rect_fill_bytes(raw):
+        return 0
+
+    remove_spans = []
+    path_spans = []
     path_rects = []
     path_has_non_rect = False
 
     fill_color = (0.0, 0.0, 0.0)
-    color_stack = [fill_color]
+    color_stack = array("d", fill_color)
 
-    def reset_path():
-        nonlocal path_indices, path_rects, path_has_non_rect
-        path_indices = []
-        path_rects = []
-        path_has_non_rect = False
-
-    for idx, (operands, operator) in enumerate(operations):
-        if operator == b"q":
-            color_stack.append(fill_color)
-        elif operator == b"Q":
-            fill_color = color_stack.pop() if color_stack else (0.0, 0.0, 0.0)
-        elif operator == b"g":
-            gray = float(operands[0])
-            fill_color = (gray, gray, gray)
-        elif operator == b"rg":
-            fill_color = (float(operands[0]), float(operands[1]), float(operands[2]))
-        elif operator == b"re":
-            path_indices.append(idx)
-            try:
-                _x, _y, w, h = map(float, operands)
-                path_rects.append((w, h))
-            except Exception:
+    codes = _OP_CODES
+    for operands, operator, start, end in _iter_content_ops(raw):
+        match codes.get(operator, -1):
+            case -1:
+                continue
+            case 0:  # q
+                color_stack.extend(fill_color)
+            case 1:  # Q
+                if len(color_stack) >= 3:
+                    fill_color = (
+                        color_stack[-3],
+                        color_stack[-2],
+                        color_stack[-1],
+                    )
+                    del color_stack[-3:]
+                else:
+                    fill_color = (0.0, 0.0, 0.0)
+            case 2:  # g
+                try:
+                    gray = float(operands[0])
+                except Exception:
+                    gray = 1.0
+                fill_color = (gray, gray, gray)
+            case 3:  # rg
+                try:
+                    fill_color = (
+                        float(operands[0]),
+                        float(operands[1]),
+                        float(operands[2]),
+                    )
+                except Exception:
+                    fill_color = (1.0, 1.0, 1.0)
+            case 4:  # re
+                path_spans.append((start, end))
+                if len(operands) == 4:
+                    path_rects.append(operands)
+                else:
+                    path_has_non_rect = True
+            case 5:  # path segment: m l c v y h
+                path_spans.append((start, end))
                 path_has_non_rect = True
-        elif operator in (b"m", b"l", b"c", b"v", b"y", b"h"):
-            path_indices.append(idx)
-            path_has_non_rect = True
-        elif operator in (b"f", b"f*", b"F", b"B", b"B*"):
-            if path_indices:
-                should_remove = False
-                if not path_has_non_rect and _is_black_color(fill_color):
-                    if aggressive:
-                        should_remove = True
-                    else:
-                        should_remove = any(
-                            w >= min_width and h >= min_height for w, h in path_rects
-                        )
-                if should_remove:
-                    remove_indices.update(path_indices)
-                    remove_indices.add(idx)
-            reset_path()
-        elif operator in (b"n", b"W", b"W*", b"S", b"s"):
-            reset_path()
-
-    if not remove_indices:
+            case 6:  # paint: f f* F B B*
+                if path_spans:
+                    should_remove = False
+                    if not path_has_non_rect and _is_black_color(fill_color):
+                        if aggressive:
+                            should_remove = True
+                        else:
+                            try:
+                                should_remove = any(
+                                    float(o[2]) >= min_width
+                                    and float(o[3]) >= min_height
+                                    for o in path_rects
+                                )
+                            except Exception:
+                                should_remove = False
+                    if should_remove:
+                        remove_spans.extend(path_spans)
+                        remove_spans.append((start, end))
+                path_spans = []
+                path_rects = []
+                path_has_non_rect = False
+            case _:  # path end without paint: n W W* S s
+                path_spans = []
+                path_rects = []
+                path_has_non_rect = False
+
+    if not remove_spans:
         return 0
 
-    content.operations = [
-        op for i, op in enumerate(operations) if i not in remove_indices
-    ]
-    page[NameObject("/Contents")] = content
-    return len(remove_indices)
+    pieces = []
+    prev = 0
+    for start, end in remove_spans:
+        pieces.append(raw[prev:start])
+        prev = end
+    pieces.append(raw[prev:])
+    new_data = b" ".join(pieces)
+
+    doc = page.parent
+    xrefs = page.get_contents()
+    if not xrefs:
+        return 0
+    doc.update_stream(xrefs[0], new_data)
+    if len(xrefs) > 1:
+        page.set_contents(xrefs[0])
+    return len(remove_spans)
 
 
 def main():
@@ -157,17 +588,12 @@ def main():
     base, _ext = os.path.splitext(input_path)
     output_path = f"{base}_unredacted.pdf"
 
-    reader = PdfReader(input_path)
-    writer = PdfWriter()
-    total_removed = 0
-    total_rect_ops = 0
-
-    for page in reader.pages:
-        total_removed += _remove_redaction_annots(page, aggressive=aggressive)
-        total_rect_ops += _remove_black_rectangles(
-            page, reader, aggressive=aggressive
-        )
-        writer.add_page(page)
+    # Cloning the whole document up front avoids the per-page add_page
+    # deep copy; pages are then cleaned in place on the writer's tree.
+    writer = PdfWriter(clone_from=input_path)
+    total_removed, total_rect_ops = _clean_document(
+        writer.pages, writer, aggressive=aggressive
+    )
 
     with open(output_path, "wb") as f:
         writer.write(f)